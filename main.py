@@ -1,13 +1,25 @@
 import os
-import json
-import re
-import requests
+import asyncio
+import orjson
+import hashlib
+import uuid
+import time
+import dataclasses
+import httpx
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from io import BytesIO
 from fastapi import FastAPI, HTTPException
-from fastapi.responses import JSONResponse
-from pydantic import BaseModel
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from typing import Annotated, List, Union
+from pydantic import BaseModel, Field, TypeAdapter, ValidationError
 from PIL import Image
+import redis.asyncio as redis
 import google.generativeai as genai
+from google.api_core.exceptions import ResourceExhausted
+from tenacity import AsyncRetrying, retry_if_exception_type, stop_after_attempt, wait_exponential_jitter
 from dotenv import load_dotenv
 
 # Load environment variables from .env file
@@ -20,26 +32,222 @@ if not GEMINI_API_KEY:
 
 genai.configure(api_key=GEMINI_API_KEY)
 
-# Initialize models
-vision_model = genai.GenerativeModel('gemini-2.5-flash')
-text_model = genai.GenerativeModel('gemini-2.5-flash')
+# Model used for OCR + extraction (one multimodal call per page)
+GEMINI_MODEL = 'gemini-2.5-flash'
+
+# Set REDIS_URL when running several workers, so they share results and job state
+REDIS_URL = os.getenv("REDIS_URL")
+
+# Uvicorn worker processes. Without Redis every worker has its own result cache
+# and batch job state (polls could land on the wrong worker), so default to one
+WORKERS = int(os.getenv("WORKERS", (os.cpu_count() or 1) if REDIS_URL else 1))
+if WORKERS > 1 and not REDIS_URL:
+    raise ValueError("WORKERS > 1 requires REDIS_URL so workers share cached results and batch jobs")
+
+# Max concurrent Gemini calls across all workers (keeps bursts under RPM limits)
+GEMINI_CONCURRENCY = int(os.getenv("GEMINI_CONCURRENCY", "20"))
+GEMINI_SEM = asyncio.Semaphore(max(1, GEMINI_CONCURRENCY // WORKERS))
+GEMINI_MAX_ATTEMPTS = 3  # Attempts per call when Gemini returns 429 (rate limited)
 
 app = FastAPI(
     title="Medical Bill Extraction API",
     version="1.0.0",
-    description="Extract line items from medical bills - Accepts URLs only"
+    description="Extract line items from medical bills - Accepts URLs only",
+    default_response_class=ORJSONResponse
+)
+
+# Shared async HTTP client for image downloads (created on startup)
+HTTP_CLIENT: httpx.AsyncClient = None
+DOWNLOAD_CHUNK_SIZE = 65536
+MAX_IMAGE_SIZE = (1536, 1536)  # Downscale larger scans before sending to Gemini
+
+# Process pool for image decoding, so CPU-bound PIL work stays off the event loop
+DECODE_POOL: ProcessPoolExecutor = None
+# Each worker runs its own decode pool, so split the cores
+DECODE_WORKERS = int(os.getenv("DECODE_WORKERS", max(1, (os.cpu_count() or 1) // WORKERS)))
+
+# Send a 1-token request on startup so the first user request skips TLS/auth setup
+GEMINI_WARMUP = os.getenv("GEMINI_WARMUP", "1") == "1"
+GEMINI_WARMUP_TIMEOUT = 5  # seconds
+WARMUP_TASK: asyncio.Task = None  # Runs in the background so startup never waits on Gemini
+
+
+@app.on_event("startup")
+async def startup():
+    """Create the shared HTTP client and decode pool, and warm up the Gemini connection"""
+    global HTTP_CLIENT, DECODE_POOL, WARMUP_TASK
+    HTTP_CLIENT = httpx.AsyncClient(
+        timeout=30,
+        limits=httpx.Limits(max_connections=100, max_keepalive_connections=32)
+    )
+    DECODE_POOL = make_decode_pool()
+    
+    if GEMINI_WARMUP:
+        WARMUP_TASK = asyncio.create_task(warm_up_gemini())
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    """Close the shared HTTP client, decode pool and Redis connection"""
+    if HTTP_CLIENT is not None:
+        await HTTP_CLIENT.aclose()
+    if REDIS_CLIENT is not None:
+        await REDIS_CLIENT.aclose()
+    if DECODE_POOL is not None:
+        DECODE_POOL.shutdown(wait=False, cancel_futures=True)
+    if WARMUP_TASK is not None:
+        WARMUP_TASK.cancel()
+
+
+async def warm_up_gemini():
+    """Send a 1-token request so Gemini channel/auth setup happens before the first user request"""
+    try:
+        await vision_model.generate_content_async(
+            "ping",
+            generation_config=genai.GenerationConfig(max_output_tokens=1),
+            request_options={"timeout": GEMINI_WARMUP_TIMEOUT}
+        )
+    except Exception as e:
+        # Warmup is best effort; the first real request will retry the connection
+        print(f"⚠ Gemini warmup failed: {str(e)}")
+
+
+# Schema Gemini must follow when returning a bill page
+class BillItem(BaseModel):
+    item_name: str
+    item_amount: float
+    item_rate: float
+    item_quantity: float
+
+
+class BillPage(BaseModel):
+    page_no: str
+    page_type: str
+    bill_items: List[BillItem]
+
+
+# Response models for /extract-bill-data
+class TokenUsage(BaseModel):
+    total_tokens: int
+    input_tokens: int
+    output_tokens: int
+
+
+class BillData(BaseModel):
+    pagewise_line_items: List[BillPage]
+    token_usage: TokenUsage
+    total_item_count: int
+
+
+class BillResponse(BaseModel):
+    is_success: bool
+    data: BillData
+
+
+JSON_GENERATION_CONFIG = genai.GenerationConfig(
+    response_mime_type="application/json",
+    response_schema=BillPage,
+    temperature=0
+)
+
+BATCH_GENERATION_CONFIG = genai.GenerationConfig(
+    response_mime_type="application/json",
+    response_schema=list[BillPage],  # SDK only converts built-in generics, not typing.List
+    temperature=0
 )
+BILL_PAGES_ADAPTER = TypeAdapter(list[BillPage])
+
+# Fields every extracted line item must have
+REQUIRED_ITEM_FIELDS = frozenset(('item_name', 'item_amount', 'item_rate', 'item_quantity'))
+
+# Max bill images packed into a single Gemini call by the batch endpoint
+BATCH_SIZE = int(os.getenv("BATCH_SIZE", "4"))
+# Max pages (URLs) in one /extract-bill-data request
+MAX_DOCUMENT_PAGES = int(os.getenv("MAX_DOCUMENT_PAGES", "32"))
+
+# Sync batch limits: documents per request, and chunks in flight at once
+# (keeps downloads well under the HTTP client's 100 connections)
+MAX_BATCH_DOCUMENTS = int(os.getenv("MAX_BATCH_DOCUMENTS", "64"))
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "4"))
+
+# A RUNNING backlog job whose progress hasn't been written for this long
+# (seconds) is reported as FAILED - its worker was restarted or killed.
+# Must exceed the time one chunk can take (downloads plus Gemini retries)
+BATCH_JOB_STALE_AFTER = int(os.getenv("BATCH_JOB_STALE_AFTER", "900"))
+
+EXTRACTION_PROMPT = """
+You are an expert OCR system and medical bill data extraction expert.
+Read ALL text from this medical bill image and extract its line item details.
+
+OCR INSTRUCTIONS:
+1. Read EVERY piece of text you see, including headers, line items, amounts and dates
+2. Preserve the structure and relationships between items
+3. If there are tables, follow the tabular structure row by row
+4. Pay special attention to:
+   - Item names/descriptions
+   - Quantities
+   - Rates/unit prices
+   - Amounts/totals
+   - Any subtotals or grand totals
+
+CRITICAL INSTRUCTIONS:
+1. ONLY extract MONETARY line items (products/services with amounts)
+2. DO NOT extract dates, invoice numbers, or non-monetary fields as amounts
+3. Each line item MUST have:
+   - item_name: The product/service description (string) - EXACTLY as in bill
+   - item_amount: The NET amount AFTER discounts (float, currency value)
+   - item_rate: The unit price (float, currency value)
+   - item_quantity: The quantity purchased (float, can be 1 if not specified)
 
+4. Determine page_type from content:
+   - "Bill Detail": Detailed itemized charges
+   - "Final Bill": Summary/total page
+   - "Pharmacy": Pharmacy/medication items
 
-# Request model - ONLY accepts URL
+5. VALIDATION RULES:
+   - item_amount should equal item_rate × item_quantity (or close to it)
+   - Only include items with valid currency amounts
+   - Skip header rows, totals rows, and non-item entries
+   - DO NOT include subtotals or grand totals as line items
+
+6. COMMON MISTAKES TO AVOID:
+   - DO NOT put invoice date/time in item_amount
+   - DO NOT put invoice number in item_amount
+   - DO NOT include tax rows as line items
+   - DO NOT include "Total", "Subtotal", "Grand Total" as line items
+"""
+
+BATCH_PROMPT = """
+You are given {count} medical bill images. Extract each one following the
+system instructions, and return a JSON array of length {count}: one object
+per image, in the same order as the images.
+"""
+
+# Extraction prompt is the system instruction, so requests only carry images
+vision_model = genai.GenerativeModel(GEMINI_MODEL, system_instruction=EXTRACTION_PROMPT)
+
+
+# Request model - ONLY accepts URLs (one per page)
 class BillExtractionRequest(BaseModel):
-    document: str  # Must be a valid URL (http/https)
+    document: Union[str, Annotated[List[str], Field(max_length=MAX_DOCUMENT_PAGES)]]  # Valid URL(s) (http/https), one per page
+
+
+# Batch request model - one URL per (single page) bill
+class BillBatchRequest(BaseModel):
+    documents: List[str] = Field(max_length=MAX_BATCH_DOCUMENTS)  # Valid URLs (http/https)
 
 
+# Backlog request model - like a batch, but processed in the background with no size limit
+class BillBacklogRequest(BaseModel):
+    documents: List[str]  # Valid URLs (http/https)
+
+
+@dataclasses.dataclass(slots=True)
 class TokenTracker:
     """Track token usage across API calls"""
-    def __init__(self):
-        self.reset()
+    total_tokens: int = 0
+    input_tokens: int = 0
+    output_tokens: int = 0
     
     def reset(self):
         self.total_tokens = 0
@@ -48,13 +256,137 @@ class TokenTracker:
     
     def add_usage(self, response):
         """Add token usage from a Gemini response"""
-        if hasattr(response, 'usage_metadata'):
-            self.input_tokens += response.usage_metadata.prompt_token_count
-            self.output_tokens += response.usage_metadata.candidates_token_count
-            self.total_tokens += response.usage_metadata.total_token_count
+        try:
+            usage = response.usage_metadata
+        except AttributeError:
+            return
+        self.input_tokens += usage.prompt_token_count
+        self.output_tokens += usage.candidates_token_count
+        self.total_tokens += usage.total_token_count
+
+
+class ResultCache:
+    """In-process LRU cache of validated results, keyed by document hash"""
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._items = OrderedDict()
+    
+    @staticmethod
+    def key_for(urls: List[str]) -> str:
+        """Hash the document URL(s) into a cache key"""
+        return hashlib.sha256("\n".join(urls).encode()).hexdigest()
+    
+    async def get(self, key: str):
+        """Return the cached value (or None) and mark it recently used"""
+        if key not in self._items:
+            return None
+        self._items.move_to_end(key)
+        return self._items[key]
+    
+    async def set(self, key: str, value):
+        """Store a value, evicting the least recently used entry if full"""
+        if self.max_size <= 0:
+            return
+        self._items[key] = value
+        self._items.move_to_end(key)
+        if len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+
+
+class RedisCache:
+    """
+    Redis-backed cache shared by all workers (same interface as ResultCache)
+    With best_effort, Redis errors are treated as cache misses instead of failing
+    """
+    def __init__(self, client: redis.Redis, prefix: str, ttl: int, best_effort: bool = False):
+        self.client = client
+        self.prefix = prefix
+        self.ttl = ttl
+        self.best_effort = best_effort
+    
+    async def get(self, key: str):
+        """Return the cached value (or None)"""
+        try:
+            value = await self.client.get(self.prefix + key)
+        except redis.RedisError as e:
+            if not self.best_effort:
+                raise
+            print(f"⚠ Redis cache read failed, treating as miss: {str(e)}")
+            return None
+        return None if value is None else orjson.loads(value)
+    
+    async def set(self, key: str, value):
+        """Store a value, expiring after ttl seconds"""
+        try:
+            await self.client.set(self.prefix + key, orjson.dumps(value), ex=self.ttl)
+        except redis.RedisError as e:
+            if not self.best_effort:
+                raise
+            print(f"⚠ Redis cache write failed, skipping: {str(e)}")
+
+
+REDIS_CLIENT = redis.from_url(REDIS_URL) if REDIS_URL else None
+CACHE_TTL = int(os.getenv("CACHE_TTL", "86400"))  # seconds, Redis only
+
+
+def make_cache(prefix: str, max_size: int, best_effort: bool = False):
+    """Redis cache if REDIS_URL is set, otherwise an in-process LRU"""
+    if REDIS_CLIENT is not None:
+        return RedisCache(REDIS_CLIENT, prefix, CACHE_TTL, best_effort)
+    return ResultCache(max_size)
+
+
+# Optional cache: a Redis outage just means re-extracting
+RESULT_CACHE = make_cache("result:", int(os.getenv("RESULT_CACHE_SIZE", "256")), best_effort=True)
+
+# Status/results of background backlog jobs, keyed by batch_id
+BATCH_JOBS = make_cache("batch:", int(os.getenv("BATCH_JOBS_SIZE", "1024")))
+BATCH_TASKS = set()  # Strong references so running jobs aren't garbage collected
+
+
+def preprocess_image(image: Image.Image) -> Image.Image:
+    """
+    Normalize a bill scan before sending it to Gemini
+    Gemini bills images per tile, so grayscale + a capped long edge cuts
+    input tokens without hurting OCR quality
+    """
+    image = image.convert("L")
+    image.thumbnail(MAX_IMAGE_SIZE, Image.Resampling.LANCZOS)
+    return image
+
+
+def decode_image(content: bytes) -> Image.Image:
+    """Decode and preprocess downloaded image bytes (runs in DECODE_POOL)"""
+    return preprocess_image(Image.open(BytesIO(content)))
+
+
+def make_decode_pool() -> ProcessPoolExecutor:
+    """
+    Create the image decode pool
+    Uses forkserver where available: the pool starts its processes lazily,
+    after the server has started threads, and forking a threaded process is unsafe
+    """
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        return ProcessPoolExecutor(max_workers=DECODE_WORKERS, mp_context=multiprocessing.get_context("forkserver"))
+    return ProcessPoolExecutor(max_workers=DECODE_WORKERS)
+
+
+async def decode_in_pool(content: bytes) -> Image.Image:
+    """Decode image bytes in DECODE_POOL, replacing the pool if a worker died"""
+    global DECODE_POOL
+    pool = DECODE_POOL
+    try:
+        return await asyncio.get_running_loop().run_in_executor(pool, decode_image, content)
+    except BrokenProcessPool:
+        # A decode worker died (e.g. OOM killer on a huge scan), which breaks the
+        # pool for good; replace it so later requests still work
+        if DECODE_POOL is pool:
+            pool.shutdown(wait=False, cancel_futures=True)
+            DECODE_POOL = make_decode_pool()
+        raise
 
 
-def download_image_from_url(url: str) -> Image.Image:
+async def download_image_from_url(url: str) -> Image.Image:
     """
     Download image from URL ONLY
     No base64 support - URLs only as per requirement
@@ -67,10 +399,19 @@ def download_image_from_url(url: str) -> Image.Image:
         )
     
     try:
-        response = requests.get(url, timeout=30)
-        response.raise_for_status()
-        return Image.open(BytesIO(response.content))
-    except requests.exceptions.RequestException as e:
+        # Collect the streamed chunks and join them once; the chunk list is
+        # released before decoding, so only one copy of the file is held
+        # while waiting on DECODE_POOL
+        chunks = []
+        async with HTTP_CLIENT.stream("GET", url) as response:
+            response.raise_for_status()
+            async for chunk in response.aiter_bytes(DOWNLOAD_CHUNK_SIZE):
+                chunks.append(chunk)
+        content = b"".join(chunks)
+        del chunks
+        
+        return await decode_in_pool(content)
+    except httpx.HTTPError as e:
         raise HTTPException(
             status_code=400,
             detail=f"Failed to download image from URL: {str(e)}"
@@ -82,155 +423,158 @@ def download_image_from_url(url: str) -> Image.Image:
         )
 
 
-def extract_text_with_vision(image: Image.Image, tracker: TokenTracker) -> str:
+async def generate_content(contents, **options):
     """
-    Step 1: Extract text from image using Gemini Vision (OCR)
+    Call Gemini under the GEMINI_SEM concurrency cap, retrying rate-limit
+    (429) errors with jittered exponential backoff
     """
-    ocr_prompt = """
-    You are an expert OCR system. Extract ALL text from this medical bill image.
-    
-    Instructions:
-    1. Extract EVERY piece of text you see, maintaining the original layout
-    2. Include headers, line items, amounts, dates, and any other text
-    3. Preserve the structure and relationships between items
-    4. Pay special attention to:
-       - Item names/descriptions
-       - Quantities
-       - Rates/unit prices
-       - Amounts/totals
-       - Any subtotals or grand totals
-    5. If there are tables, maintain the tabular structure
-    
-    Return ONLY the extracted text, nothing else.
+    async for attempt in AsyncRetrying(
+        stop=stop_after_attempt(GEMINI_MAX_ATTEMPTS),
+        wait=wait_exponential_jitter(initial=1, max=8),
+        retry=retry_if_exception_type(ResourceExhausted),
+        reraise=True
+    ):
+        with attempt:
+            async with GEMINI_SEM:
+                return await vision_model.generate_content_async(contents, **options)
+
+
+async def parse_to_json(image: Image.Image, tracker: TokenTracker) -> dict:
+    """
+    Extract structured JSON directly from the bill image using Gemini Vision
+    (OCR and line item extraction in a single call)
     """
-    
     try:
-        response = vision_model.generate_content([ocr_prompt, image])
+        response = await generate_content(
+            [image],
+            generation_config=JSON_GENERATION_CONFIG
+        )
         tracker.add_usage(response)
-        return response.text
+        
+        return BillPage.model_validate_json(response.text).model_dump()
+    except ResourceExhausted as e:
+        raise HTTPException(
+            status_code=429,
+            detail=f"Gemini rate limit exceeded, retry later: {str(e)}"
+        )
+    except ValidationError as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Gemini response did not match the bill schema: {str(e)}"
+        )
     except Exception as e:
         raise HTTPException(
             status_code=500,
-            detail=f"OCR extraction failed: {str(e)}"
+            detail=f"Extraction failed: {str(e)}"
         )
 
 
-def parse_to_json(ocr_text: str, tracker: TokenTracker) -> dict:
+async def parse_batch_to_json(images: List[Image.Image], tracker: TokenTracker) -> List[dict]:
     """
-    Step 2: Parse OCR text into structured JSON format
-    """
-    extraction_prompt = f"""
-    You are a medical bill data extraction expert. Extract line item details from this bill text.
-    
-    BILL TEXT:
-    {ocr_text}
-    
-    CRITICAL INSTRUCTIONS:
-    1. ONLY extract MONETARY line items (products/services with amounts)
-    2. DO NOT extract dates, invoice numbers, or non-monetary fields as amounts
-    3. Each line item MUST have:
-       - item_name: The product/service description (string) - EXACTLY as in bill
-       - item_amount: The NET amount AFTER discounts (float, currency value)
-       - item_rate: The unit price (float, currency value)
-       - item_quantity: The quantity purchased (float, can be 1 if not specified)
-    
-    4. Determine page_type from content:
-       - "Bill Detail": Detailed itemized charges
-       - "Final Bill": Summary/total page
-       - "Pharmacy": Pharmacy/medication items
-    
-    5. VALIDATION RULES:
-       - item_amount should equal item_rate × item_quantity (or close to it)
-       - Only include items with valid currency amounts
-       - Skip header rows, totals rows, and non-item entries
-       - DO NOT include subtotals or grand totals as line items
-    
-    6. COMMON MISTAKES TO AVOID:
-       - DO NOT put invoice date/time in item_amount
-       - DO NOT put invoice number in item_amount
-       - DO NOT include tax rows as line items
-       - DO NOT include "Total", "Subtotal", "Grand Total" as line items
-    
-    Return ONLY valid JSON in this exact format:
-    {{
-        "page_no": "1",
-        "page_type": "Bill Detail",
-        "bill_items": [
-            {{
-                "item_name": "Item description",
-                "item_amount": 100.50,
-                "item_rate": 50.25,
-                "item_quantity": 2.0
-            }}
-        ]
-    }}
-    
-    Return ONLY the JSON, no markdown backticks, no explanations.
+    Extract structured JSON for several bill images in a single Gemini call
+    (one result object per image, in order)
     """
+    batch_prompt = BATCH_PROMPT.format(count=len(images))
     
     try:
-        response = text_model.generate_content(extraction_prompt)
+        response = await generate_content(
+            [batch_prompt, *images],
+            generation_config=BATCH_GENERATION_CONFIG
+        )
         tracker.add_usage(response)
         
-        # Clean and parse JSON
-        json_text = response.text.strip()
-        # Remove markdown code blocks if present
-        json_text = re.sub(r'^```json\s*', '', json_text)
-        json_text = re.sub(r'^```\s*', '', json_text)
-        json_text = re.sub(r'\s*```$', '', json_text)
-        
-        return json.loads(json_text)
-    except json.JSONDecodeError as e:
+        results = [page.model_dump() for page in BILL_PAGES_ADAPTER.validate_json(response.text)]
+    except ResourceExhausted as e:
+        raise HTTPException(
+            status_code=429,
+            detail=f"Gemini rate limit exceeded, retry later: {str(e)}"
+        )
+    except ValidationError as e:
         raise HTTPException(
             status_code=500,
-            detail=f"Failed to parse JSON: {str(e)}"
+            detail=f"Gemini response did not match the bill schema: {str(e)}"
         )
     except Exception as e:
         raise HTTPException(
             status_code=500,
-            detail=f"Extraction failed: {str(e)}"
+            detail=f"Batch extraction failed: {str(e)}"
         )
+    
+    if len(results) != len(images):
+        raise HTTPException(
+            status_code=500,
+            detail=f"Batch extraction returned {len(results)} results for {len(images)} images"
+        )
+    return results
+
+
+def clean_item(item: dict):
+    """Return the item with numeric fields as floats, or None if invalid"""
+    # Ensure all required fields exist
+    if not REQUIRED_ITEM_FIELDS.issubset(item):
+        return None
+    
+    # Convert to proper types
+    try:
+        amount = float(item['item_amount'])
+        rate = float(item['item_rate'])
+        quantity = float(item['item_quantity'])
+    except (ValueError, TypeError):
+        return None
+    
+    # Skip invalid amounts and amounts that look like a date/ID (very large numbers)
+    if not 0 < amount <= 1000000:
+        return None
+    
+    item['item_amount'], item['item_rate'], item['item_quantity'] = amount, rate, quantity
+    return item
 
 
 def validate_and_clean(data: dict) -> dict:
     """Validate and clean extracted data"""
-    if 'bill_items' not in data:
-        data['bill_items'] = []
-    
-    cleaned_items = []
-    for item in data['bill_items']:
-        # Ensure all required fields exist
-        if not all(k in item for k in ['item_name', 'item_amount', 'item_rate', 'item_quantity']):
-            continue
-        
-        # Convert to proper types
-        try:
-            item['item_amount'] = float(item['item_amount'])
-            item['item_rate'] = float(item['item_rate'])
-            item['item_quantity'] = float(item['item_quantity'])
-        except (ValueError, TypeError):
-            continue
-        
-        # Skip items with invalid amounts
-        if item['item_amount'] <= 0:
-            continue
-        
-        # Skip if amount looks like a date/ID (very large numbers)
-        if item['item_amount'] > 1000000:
-            continue
-        
-        cleaned_items.append(item)
-    
-    data['bill_items'] = cleaned_items
+    data['bill_items'] = [
+        item for item in map(clean_item, data.get('bill_items', [])) if item is not None
+    ]
     return data
 
 
-@app.post("/extract-bill-data")
+async def gather_or_cancel(*coros) -> list:
+    """Like asyncio.gather, but cancels the remaining tasks as soon as one fails"""
+    tasks = [asyncio.ensure_future(coro) for coro in coros]
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        # Don't keep downloading / spending tokens for a request that already failed
+        for task in tasks:
+            task.cancel()
+        raise
+
+
+async def extract_page(url: str, page_no: int, tracker: TokenTracker) -> dict:
+    """Download, extract and validate a single bill page"""
+    # Step 1: Download page image from URL
+    image = await download_image_from_url(url)
+    
+    # Step 2: Extract structured JSON with Gemini Vision
+    structured_data = await parse_to_json(image, tracker)
+    
+    # Step 3: Validate and clean
+    validated_data = validate_and_clean(structured_data)
+    validated_data['page_no'] = str(page_no)
+    return validated_data
+
+
+def sse_event(event: str, data: dict) -> str:
+    """Format a Server-Sent Event with a JSON payload"""
+    return f"event: {event}\ndata: {orjson.dumps(data).decode()}\n\n"
+
+
+@app.post("/extract-bill-data", response_model=BillResponse)
 async def extract_bill_data(request: BillExtractionRequest):
     """
     Main API endpoint - Extracts line items from medical bill
     
-    Accepts ONLY URLs:
+    Accepts ONLY URLs (a list of URLs for multi-page bills):
     {
         "document": "https://example.com/bill.png"
     }
@@ -246,47 +590,268 @@ async def extract_bill_data(request: BillExtractionRequest):
     }
     """
     tracker = TokenTracker()
+    urls = [request.document] if isinstance(request.document, str) else request.document
     
     try:
-        # Step 1: Download image from URL
-        image = download_image_from_url(request.document)
+        # Repeat submissions are served from cache (no tokens spent)
+        cache_key = ResultCache.key_for(urls)
+        pagewise_line_items = await RESULT_CACHE.get(cache_key)
         
-        # Step 2: Extract text using Gemini Vision (OCR)
-        ocr_text = extract_text_with_vision(image, tracker)
+        if pagewise_line_items is None:
+            # Steps 1-3: Download, extract and validate all pages concurrently
+            pagewise_line_items = await gather_or_cancel(*[
+                extract_page(url, page_no, tracker)
+                for page_no, url in enumerate(urls, start=1)
+            ])
+            
+            await RESULT_CACHE.set(cache_key, pagewise_line_items)
         
-        # Step 3: Parse to structured JSON
-        structured_data = parse_to_json(ocr_text, tracker)
-        
-        # Step 4: Validate and clean
-        validated_data = validate_and_clean(structured_data)
-        
-        # Step 5: Build response in EXACT format
-        response = {
-            "is_success": True,
-            "data": {
-                "pagewise_line_items": [validated_data],
+        # Step 4: Build response in EXACT format
+        return BillResponse(
+            is_success=True,
+            data=BillData(
+                pagewise_line_items=pagewise_line_items,
+                token_usage=TokenUsage(
+                    total_tokens=tracker.total_tokens,
+                    input_tokens=tracker.input_tokens,
+                    output_tokens=tracker.output_tokens
+                ),
+                total_item_count=sum(len(page['bill_items']) for page in pagewise_line_items)
+            )
+        )
+    
+    except HTTPException as e:
+        # Re-raise HTTP exceptions
+        raise e
+    except Exception as e:
+        # Handle unexpected errors
+        return ORJSONResponse(
+            content={
+                "is_success": False,
+                "error": str(e),
+                "data": {
+                    "pagewise_line_items": [],
+                    "token_usage": {
+                        "total_tokens": tracker.total_tokens,
+                        "input_tokens": tracker.input_tokens,
+                        "output_tokens": tracker.output_tokens
+                    },
+                    "total_item_count": 0
+                }
+            },
+            status_code=500
+        )
+
+
+@app.post("/extract-bill-data-stream")
+async def extract_bill_data_stream(request: BillExtractionRequest):
+    """
+    Streaming endpoint - Same input as /extract-bill-data, but streams each
+    page as a Server-Sent Event as soon as it is extracted (in completion order).
+    Shares the result cache with /extract-bill-data; cached pages stream at once
+    
+    Events:
+        event: page   data: {"page_no": "2", "page_type": "...", "bill_items": [...]}
+        event: done   data: {"token_usage": {...}, "total_item_count": 12}
+        event: error  data: {"error": "..."}
+    """
+    tracker = TokenTracker()
+    urls = [request.document] if isinstance(request.document, str) else request.document
+    
+    async def events():
+        tasks = []
+        total_item_count = 0
+        try:
+            # Repeat submissions are served from cache (no tokens spent)
+            cache_key = ResultCache.key_for(urls)
+            cached_pages = await RESULT_CACHE.get(cache_key)
+            
+            if cached_pages is not None:
+                for page in cached_pages:
+                    total_item_count += len(page['bill_items'])
+                    yield sse_event("page", page)
+            else:
+                tasks = [
+                    asyncio.create_task(extract_page(url, page_no, tracker))
+                    for page_no, url in enumerate(urls, start=1)
+                ]
+                for next_page in asyncio.as_completed(tasks):
+                    page = await next_page
+                    total_item_count += len(page['bill_items'])
+                    yield sse_event("page", page)
+                
+                await RESULT_CACHE.set(cache_key, [task.result() for task in tasks])
+            
+            yield sse_event("done", {
                 "token_usage": {
                     "total_tokens": tracker.total_tokens,
                     "input_tokens": tracker.input_tokens,
                     "output_tokens": tracker.output_tokens
                 },
-                "total_item_count": len(validated_data['bill_items'])
-            }
+                "total_item_count": total_item_count
+            })
+        except HTTPException as e:
+            yield sse_event("error", {"error": e.detail})
+        except Exception as e:
+            yield sse_event("error", {"error": str(e)})
+        finally:
+            # Stop remaining Gemini calls if a page failed or the client disconnected
+            for task in tasks:
+                task.cancel()
+    
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+
+def failed_bill(url: str, error: Exception) -> dict:
+    """Batch entry for a bill that could not be downloaded or extracted"""
+    return {
+        "document": url,
+        "is_success": False,
+        "error": error.detail if isinstance(error, HTTPException) else str(error),
+        "pagewise_line_items": [],
+        "total_item_count": 0
+    }
+
+
+async def extract_bill_chunk(urls: List[str], tracker: TokenTracker) -> List[dict]:
+    """
+    Extract up to BATCH_SIZE single-page bills with one Gemini call
+    Failures are recorded per bill instead of failing the whole chunk
+    """
+    bills = [None] * len(urls)
+    
+    # Step 1: Download the chunk's images concurrently
+    downloads = await asyncio.gather(*[download_image_from_url(url) for url in urls], return_exceptions=True)
+    downloaded = []
+    for i, result in enumerate(downloads):
+        if isinstance(result, Exception):
+            bills[i] = failed_bill(urls[i], result)
+        else:
+            downloaded.append((i, result))
+    if not downloaded:
+        return bills
+    
+    # Step 2: Extract structured JSON for all downloaded images in one call
+    try:
+        pages = await parse_batch_to_json([image for _, image in downloaded], tracker)
+    except Exception as e:
+        for i, _ in downloaded:
+            bills[i] = failed_bill(urls[i], e)
+        return bills
+    
+    # Step 3: Validate and clean each bill
+    for (i, _), structured_data in zip(downloaded, pages):
+        validated_data = validate_and_clean(structured_data)
+        validated_data['page_no'] = "1"
+        bills[i] = {
+            "document": urls[i],
+            "is_success": True,
+            "pagewise_line_items": [validated_data],
+            "total_item_count": len(validated_data['bill_items'])
+        }
+    return bills
+
+
+def build_batch_data(bills: List[dict], tracker: TokenTracker) -> dict:
+    """Build the data section of a batch response"""
+    return {
+        "bills": bills,
+        "token_usage": {
+            "total_tokens": tracker.total_tokens,
+            "input_tokens": tracker.input_tokens,
+            "output_tokens": tracker.output_tokens
+        },
+        "total_item_count": sum(bill['total_item_count'] for bill in bills)
+    }
+
+
+async def run_batch_job(batch_id: str, request: BillBacklogRequest, started_at: float):
+    """
+    Run a backlog job in the background and record its outcome
+    Bills are processed BATCH_SIZE at a time (download, then extract), so
+    only one chunk of images is held in memory and connections stay bounded
+    """
+    tracker = TokenTracker()
+    urls = request.documents
+    try:
+        bills = []
+        for start in range(0, len(urls), BATCH_SIZE):
+            bills.extend(await extract_bill_chunk(urls[start:start + BATCH_SIZE], tracker))
+            await BATCH_JOBS.set(batch_id, {
+                "status": "RUNNING",
+                "completed": len(bills),
+                "total": len(urls),
+                "started_at": started_at,
+                "updated_at": time.time()
+            })
+        
+        await BATCH_JOBS.set(batch_id, {
+            "status": "SUCCEEDED",
+            "is_success": True,
+            "data": build_batch_data(bills, tracker)
+        })
+    except HTTPException as e:
+        await BATCH_JOBS.set(batch_id, {"status": "FAILED", "is_success": False, "error": e.detail})
+    except Exception as e:
+        await BATCH_JOBS.set(batch_id, {"status": "FAILED", "is_success": False, "error": str(e)})
+
+
+@app.post("/extract-bill-data-batch")
+async def extract_bill_data_batch(request: BillBatchRequest):
+    """
+    Batch endpoint - Extracts line items from up to MAX_BATCH_DOCUMENTS
+    single-page bills, packing up to BATCH_SIZE images into each Gemini call
+    (BATCH_CONCURRENCY chunks at a time). Use /extract-bills-async for more
+    
+    Accepts ONLY URLs:
+    {
+        "documents": ["https://example.com/bill1.png", "https://example.com/bill2.png"]
+    }
+    
+    Returns one entry per document, in order (failed bills have
+    "is_success": false and an "error"):
+    {
+        "is_success": true,
+        "data": {
+            "bills": [{"document": "...", "is_success": true, "pagewise_line_items": [...], "total_item_count": 3}, ...],
+            "token_usage": {...},
+            "total_item_count": 12
+        }
+    }
+    """
+    tracker = TokenTracker()
+    
+    urls = request.documents
+    
+    try:
+        chunk_sem = asyncio.Semaphore(BATCH_CONCURRENCY)
+        
+        async def run_chunk(chunk):
+            async with chunk_sem:
+                return await extract_bill_chunk(chunk, tracker)
+        
+        chunks = [urls[i:i + BATCH_SIZE] for i in range(0, len(urls), BATCH_SIZE)]
+        chunk_results = await asyncio.gather(*[run_chunk(chunk) for chunk in chunks])
+        bills = [bill for result in chunk_results for bill in result]
+        
+        response = {
+            "is_success": True,
+            "data": build_batch_data(bills, tracker)
         }
         
-        return JSONResponse(content=response, status_code=200)
+        return ORJSONResponse(content=response, status_code=200)
     
     except HTTPException as e:
         # Re-raise HTTP exceptions
         raise e
     except Exception as e:
         # Handle unexpected errors
-        return JSONResponse(
+        return ORJSONResponse(
             content={
                 "is_success": False,
                 "error": str(e),
                 "data": {
-                    "pagewise_line_items": [],
+                    "bills": [],
                     "token_usage": {
                         "total_tokens": tracker.total_tokens,
                         "input_tokens": tracker.input_tokens,
@@ -299,6 +864,67 @@ async def extract_bill_data(request: BillExtractionRequest):
         )
 
 
+@app.post("/extract-bills-async")
+async def extract_bills_async(request: BillBacklogRequest):
+    """
+    Backlog endpoint - Queues several single-page bills for background
+    extraction and returns immediately
+    
+    Accepts ONLY URLs:
+    {
+        "documents": ["https://example.com/bill1.png", "https://example.com/bill2.png"]
+    }
+    
+    Bills are processed BATCH_SIZE at a time at standard Gemini pricing.
+    Returns a batch_id to poll via GET /batch/{batch_id}:
+    {
+        "batch_id": "...",
+        "status": "RUNNING"
+    }
+    """
+    batch_id = uuid.uuid4().hex
+    started_at = time.time()
+    await BATCH_JOBS.set(batch_id, {
+        "status": "RUNNING",
+        "completed": 0,
+        "total": len(request.documents),
+        "started_at": started_at,
+        "updated_at": started_at
+    })
+    
+    task = asyncio.create_task(run_batch_job(batch_id, request, started_at))
+    BATCH_TASKS.add(task)
+    task.add_done_callback(BATCH_TASKS.discard)
+    
+    return {"batch_id": batch_id, "status": "RUNNING"}
+
+
+@app.get("/batch/{batch_id}")
+async def get_batch_status(batch_id: str):
+    """
+    Status of a backlog job: RUNNING (with completed/total bill counts),
+    SUCCEEDED (with the same data as /extract-bill-data-batch, including
+    per-bill failures) or FAILED (with an error)
+    
+    Jobs run inside the worker that accepted them and are not resumed after
+    a restart. A RUNNING job whose progress is older than
+    BATCH_JOB_STALE_AFTER seconds is therefore reported as FAILED
+    """
+    job = await BATCH_JOBS.get(batch_id)
+    if job is None:
+        raise HTTPException(
+            status_code=404,
+            detail=f"Unknown batch_id: {batch_id}"
+        )
+    if job["status"] == "RUNNING" and time.time() - job["updated_at"] > BATCH_JOB_STALE_AFTER:
+        job = {
+            "status": "FAILED",
+            "is_success": False,
+            "error": f"Job made no progress for {BATCH_JOB_STALE_AFTER}s; its worker was probably restarted. Resubmit the documents"
+        }
+    return {"batch_id": batch_id, **job}
+
+
 @app.get("/")
 def home():
     """Root endpoint with API info"""
@@ -309,6 +935,10 @@ def home():
         "accepts": "URLs only (http/https)",
         "endpoints": {
             "/extract-bill-data": "POST - Extract line items from bill image URL",
+            "/extract-bill-data-stream": "POST - Stream line items page by page (Server-Sent Events)",
+            "/extract-bill-data-batch": "POST - Extract line items from several bill image URLs",
+            "/extract-bills-async": "POST - Queue several bill image URLs for background extraction",
+            "/batch/{batch_id}": "GET - Status and results of a background extraction",
             "/health": "GET - Health check",
             "/docs": "GET - Interactive API documentation"
         },
@@ -337,9 +967,18 @@ if __name__ == "__main__":
     print(f"✓ Server: http://localhost:8000")
     print(f"✓ Docs: http://localhost:8000/docs")
     print(f"✓ Health: http://localhost:8000/health")
+    print(f"✓ Workers: {WORKERS} ({'shared Redis cache' if REDIS_URL else 'set REDIS_URL to run more than one'})")
     print("=" * 80)
     print("\n API accepts ONLY URLs")
     print("   Request: {'document': 'https://example.com/bill.png'}\n")
     
 
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    # Workers need an import string; "auto" picks uvloop/httptools when installed
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=8000,
+        workers=WORKERS,
+        loop="auto",
+        http="auto"
+    )
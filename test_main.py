@@ -0,0 +1,263 @@
+import asyncio
+import io
+import time
+import os
+
+os.environ.setdefault("GEMINI_API_KEY", "test-key")
+
+import httpx
+import main
+import pytest
+from PIL import Image
+from google.generativeai import protos
+
+
+def build_request(generation_config):
+    """Build a generate_content request through the real SDK (no network call)"""
+    return main.vision_model._prepare_request(
+        contents=["ping"],
+        generation_config=generation_config,
+        safety_settings=None,
+        tools=None,
+        tool_config=None
+    )
+
+
+def test_page_generation_config_builds_object_schema():
+    schema = build_request(main.JSON_GENERATION_CONFIG).generation_config.response_schema
+    assert schema.type_ == protos.Type.OBJECT
+    assert set(schema.properties) == {"page_no", "page_type", "bill_items"}
+
+
+def test_batch_generation_config_builds_array_schema():
+    schema = build_request(main.BATCH_GENERATION_CONFIG).generation_config.response_schema
+    assert schema.type_ == protos.Type.ARRAY
+    assert schema.items.type_ == protos.Type.OBJECT
+    assert set(schema.items.properties) == {"page_no", "page_type", "bill_items"}
+
+
+def test_extract_bill_chunk_records_failures_per_bill(monkeypatch):
+    async def fake_download(url):
+        if "broken" in url:
+            raise main.HTTPException(status_code=400, detail="Failed to download image from URL: 404")
+        return url
+
+    async def fake_parse_batch(images, tracker):
+        return [{"page_no": "1", "page_type": "Bill Detail", "bill_items": []} for _ in images]
+
+    monkeypatch.setattr(main, "download_image_from_url", fake_download)
+    monkeypatch.setattr(main, "parse_batch_to_json", fake_parse_batch)
+
+    urls = ["https://a/1.png", "https://a/broken.png", "https://a/3.png"]
+    bills = asyncio.run(main.extract_bill_chunk(urls, main.TokenTracker()))
+
+    assert [bill["document"] for bill in bills] == urls
+    assert [bill["is_success"] for bill in bills] == [True, False, True]
+    assert "404" in bills[1]["error"]
+
+
+def test_backlog_job_downloads_one_chunk_at_a_time(monkeypatch):
+    in_flight = peak = 0
+
+    async def fake_download(url):
+        nonlocal in_flight, peak
+        in_flight += 1
+        peak = max(peak, in_flight)
+        await asyncio.sleep(0)
+        in_flight -= 1
+        return url
+
+    async def fake_parse_batch(images, tracker):
+        return [{"page_no": "1", "page_type": "Bill Detail", "bill_items": []} for _ in images]
+
+    monkeypatch.setattr(main, "download_image_from_url", fake_download)
+    monkeypatch.setattr(main, "parse_batch_to_json", fake_parse_batch)
+
+    urls = [f"https://a/{i}.png" for i in range(3 * main.BATCH_SIZE + 1)]
+    request = main.BillBacklogRequest(documents=urls)
+    asyncio.run(main.run_batch_job("job", request, time.time()))
+    job = asyncio.run(main.BATCH_JOBS.get("job"))
+
+    assert peak <= main.BATCH_SIZE
+    assert job["status"] == "SUCCEEDED"
+    assert len(job["data"]["bills"]) == len(urls)
+
+
+def test_batch_status_reports_stale_running_job_as_failed():
+    stale = time.time() - main.BATCH_JOB_STALE_AFTER - 1
+    fresh = time.time()
+
+    async def run():
+        await main.BATCH_JOBS.set("stale", {"status": "RUNNING", "completed": 4, "total": 8, "started_at": stale, "updated_at": stale})
+        await main.BATCH_JOBS.set("fresh", {"status": "RUNNING", "completed": 4, "total": 8, "started_at": fresh, "updated_at": fresh})
+        return await main.get_batch_status("stale"), await main.get_batch_status("fresh")
+
+    stale_job, fresh_job = asyncio.run(run())
+    assert stale_job["status"] == "FAILED"
+    assert stale_job["is_success"] is False
+    assert fresh_job["status"] == "RUNNING"
+    assert fresh_job["completed"] == 4
+
+
+def test_best_effort_redis_cache_treats_outage_as_miss():
+    class DownRedis:
+        async def get(self, key):
+            raise main.redis.ConnectionError("connection refused")
+
+        async def set(self, key, value, ex=None):
+            raise main.redis.ConnectionError("connection refused")
+
+    cache = main.RedisCache(DownRedis(), "result:", 60, best_effort=True)
+    assert asyncio.run(cache.get("key")) is None
+    asyncio.run(cache.set("key", [{"bill_items": []}]))
+
+    strict = main.RedisCache(DownRedis(), "batch:", 60)
+    with pytest.raises(main.redis.ConnectionError):
+        asyncio.run(strict.get("key"))
+
+
+def test_decode_pool_is_replaced_after_a_worker_dies(monkeypatch):
+    buffer = io.BytesIO()
+    Image.new("RGB", (4000, 3000), "white").save(buffer, format="PNG")
+    content = buffer.getvalue()
+
+    async def run():
+        monkeypatch.setattr(main, "DECODE_POOL", main.make_decode_pool())
+        loop = asyncio.get_running_loop()
+        with pytest.raises(main.BrokenProcessPool):
+            await loop.run_in_executor(main.DECODE_POOL, os._exit, 1)
+
+        # The first call hits the broken pool and replaces it
+        with pytest.raises(main.BrokenProcessPool):
+            await main.decode_in_pool(content)
+        image = await main.decode_in_pool(content)
+        main.DECODE_POOL.shutdown()
+        return image
+
+    image = asyncio.run(run())
+    assert image.mode == "L"
+    assert max(image.size) == 1536
+
+
+def test_stream_endpoint_reads_and_fills_result_cache(monkeypatch):
+    calls = []
+
+    async def fake_extract_page(url, page_no, tracker):
+        calls.append(url)
+        return {"page_no": str(page_no), "page_type": "Bill Detail", "bill_items": []}
+
+    monkeypatch.setattr(main, "extract_page", fake_extract_page)
+    monkeypatch.setattr(main, "RESULT_CACHE", main.ResultCache(8))
+
+    async def stream():
+        request = main.BillExtractionRequest(document=["https://a/1.png", "https://a/2.png"])
+        response = await main.extract_bill_data_stream(request)
+        return "".join([chunk async for chunk in response.body_iterator])
+
+    first = asyncio.run(stream())
+    second = asyncio.run(stream())
+
+    assert len(calls) == 2  # second request served from cache
+    assert first.count("event: page") == second.count("event: page") == 2
+    assert "event: done" in second
+
+
+def test_batch_endpoint_bounds_chunks_in_flight(monkeypatch):
+    in_flight = peak = 0
+
+    async def fake_download(url):
+        nonlocal in_flight, peak
+        in_flight += 1
+        peak = max(peak, in_flight)
+        await asyncio.sleep(0)
+        in_flight -= 1
+        return url
+
+    async def fake_parse_batch(images, tracker):
+        return [{"page_no": "1", "page_type": "Bill Detail", "bill_items": []} for _ in images]
+
+    monkeypatch.setattr(main, "download_image_from_url", fake_download)
+    monkeypatch.setattr(main, "parse_batch_to_json", fake_parse_batch)
+
+    urls = [f"https://a/{i}.png" for i in range(main.MAX_BATCH_DOCUMENTS)]
+    request = main.BillBatchRequest(documents=urls)
+    response = asyncio.run(main.extract_bill_data_batch(request))
+
+    assert peak <= main.BATCH_SIZE * main.BATCH_CONCURRENCY
+    assert response.status_code == 200
+    assert len(main.orjson.loads(response.body)["data"]["bills"]) == len(urls)
+
+
+def test_batch_request_rejects_too_many_documents():
+    with pytest.raises(main.ValidationError):
+        main.BillBatchRequest(documents=["https://a/1.png"] * (main.MAX_BATCH_DOCUMENTS + 1))
+
+
+def test_extract_bill_data_cancels_other_pages_when_one_fails(monkeypatch):
+    finished = []
+
+    async def fake_extract_page(url, page_no, tracker):
+        if "broken" in url:
+            raise main.HTTPException(status_code=400, detail="Failed to download image from URL")
+        await asyncio.sleep(0.5)
+        finished.append(url)
+        return {"page_no": str(page_no), "page_type": "Bill Detail", "bill_items": []}
+
+    monkeypatch.setattr(main, "extract_page", fake_extract_page)
+    monkeypatch.setattr(main, "RESULT_CACHE", main.ResultCache(8))
+
+    async def run():
+        request = main.BillExtractionRequest(document=["https://a/1.png", "https://a/broken.png"])
+        with pytest.raises(main.HTTPException):
+            await main.extract_bill_data(request)
+        await asyncio.sleep(0.6)
+
+    asyncio.run(run())
+    assert finished == []
+
+
+def test_extraction_request_rejects_too_many_pages():
+    with pytest.raises(main.ValidationError):
+        main.BillExtractionRequest(document=["https://a/1.png"] * (main.MAX_DOCUMENT_PAGES + 1))
+    assert main.BillExtractionRequest(document="https://a/1.png").document == "https://a/1.png"
+
+
+def test_startup_does_not_wait_for_gemini_warmup(monkeypatch):
+    seen_options = []
+
+    class HungModel:
+        async def generate_content_async(self, contents, **options):
+            seen_options.append(options)
+            await asyncio.sleep(3600)
+
+    monkeypatch.setattr(main, "vision_model", HungModel())
+    monkeypatch.setattr(main, "GEMINI_WARMUP", True)
+
+    async def run():
+        await asyncio.wait_for(main.startup(), timeout=1)
+        await asyncio.sleep(0)
+        await main.shutdown()
+
+    asyncio.run(run())
+    assert seen_options[0]["request_options"]["timeout"] == main.GEMINI_WARMUP_TIMEOUT
+
+
+def test_download_image_streams_and_decodes_in_pool(monkeypatch):
+    buffer = io.BytesIO()
+    Image.new("RGB", (3000, 2000), "white").save(buffer, format="PNG")
+    png = buffer.getvalue()
+
+    transport = httpx.MockTransport(lambda request: httpx.Response(200, content=png))
+
+    async def run():
+        monkeypatch.setattr(main, "HTTP_CLIENT", httpx.AsyncClient(transport=transport))
+        monkeypatch.setattr(main, "DECODE_POOL", main.make_decode_pool())
+        try:
+            return await main.download_image_from_url("https://a/bill.png")
+        finally:
+            await main.HTTP_CLIENT.aclose()
+            main.DECODE_POOL.shutdown()
+
+    image = asyncio.run(run())
+    assert image.mode == "L"
+    assert image.size == (1536, 1024)